@@ -1,48 +1,335 @@
+"""
+Builds a text snapshot of a project directory that can be handed to the LLM (or copied to the clipboard).
+
+Files ignored by .gitignore, binaries and very large files are skipped, files are read concurrently and
+the snapshot is streamed in chunks until the token budget is spent, most relevant files first.
+"""
+
+# General imports
 import os
+import re
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pyperclip
 
+# Always skipped, on top of whatever the project's .gitignore files say
+DEFAULT_IGNORE = [".git/", "lib/", "node_modules/", "pack/", "venv/", ".venv/", ".idea/", ".run/", "gradle/",
+                  "__pycache__/", "build/"]
+
+MAX_FILE_BYTES = 256 * 1024
+DEFAULT_TOKEN_BUDGET = 100_000
+
+# Below this many tokens left no file chunk can fit (the path and separators alone take about that much)
+MIN_CHUNK_TOKENS = 16
+
+HEADER = ("This is my directory. The files are separated into folders when necessary. "
+          "Give your answer considering the structure of the project.")
+
+
+# Translates a single gitignore glob into a regular expression
+def glob_to_regex(pattern: str) -> str:
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+            continue
+        if char == "*":
+            regex += "[^/]*"
+        elif char == "?":
+            regex += "[^/]"
+        elif char == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                regex += re.escape(char)
+            else:
+                regex += "[" + pattern[i + 1:end].replace("!", "^", 1) + "]"
+                i = end
+        else:
+            regex += re.escape(char)
+        i += 1
+    return regex
+
+
+class GitIgnore:
+    """
+    Minimal .gitignore matcher supporting negation, directory-only rules, anchored rules and "**".
+
+    Rules are stored with the directory they were read from, so nested .gitignore files apply to their own
+    subtree only. As in git, the last matching rule wins.
+    """
+
+    def __init__(self, patterns: list = None):
+        self.rules = []
+        self.add_patterns(patterns or [], "")
+
+    def add_patterns(self, lines: list, base: str):
+        for line in lines:
+            line = line.rstrip("\n").rstrip()
+            if not line or line.startswith("#"):
+                continue
+
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            anchored = "/" in line
+            line = line.lstrip("/")
+
+            regex = glob_to_regex(line)
+            if not anchored:
+                regex = "(?:.*/)?" + regex
+            self.rules.append((base, re.compile(f"^{regex}$"), negate, dir_only))
+
+    def add_file(self, path: Path, base: str):
+        try:
+            with open(path, "r", encoding="utf-8", errors="replace") as file:
+                self.add_patterns(file.readlines(), base)
+        except OSError:
+            pass
+
+    def ignored(self, rel_path: str, is_dir: bool) -> bool:
+        result = False
+        for base, regex, negate, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if base:
+                if not rel_path.startswith(base + "/"):
+                    continue
+                path = rel_path[len(base) + 1:]
+            else:
+                path = rel_path
+            if regex.match(path):
+                result = not negate
+        return result
+
+
+# Walks the project and returns the relative paths of all files that are not ignored
+def collect_files(root: Path, ignore: list = None) -> list:
+    matcher = GitIgnore(DEFAULT_IGNORE + list(ignore or []))
+    files = []
+
+    for current, dirs, names in os.walk(root):
+        rel_dir = Path(current).relative_to(root).as_posix()
+        rel_dir = "" if rel_dir == "." else rel_dir
+
+        if ".gitignore" in names:
+            matcher.add_file(Path(current) / ".gitignore", rel_dir)
+
+        def rel(name):
+            return f"{rel_dir}/{name}" if rel_dir else name
+
+        # Prune ignored directories so they are never walked
+        dirs[:] = sorted(d for d in dirs if not matcher.ignored(rel(d), True))
+        files.extend(rel(name) for name in sorted(names) if not matcher.ignored(rel(name), False))
+
+    return files
+
+
+# Finds the project files imported/included by the given source file
+def find_imports(source: str, files: list) -> set:
+    targets = set()
+    for match in re.finditer(r"^\s*(?:from\s+([\w.]+)\s+import|import\s+([\w.]+))", source, re.MULTILINE):
+        targets.add((match.group(1) or match.group(2)).strip(".").replace(".", "/"))
+    for match in re.finditer(r'^\s*#\s*include\s+"([^"]+)"', source, re.MULTILINE):
+        targets.add(match.group(1))
+
+    # Compare whole path components, so "import re" does not pull in .gitignore or core.py
+    def matches(path, target):
+        return path == target or path.endswith("/" + target)
+
+    imported = set()
+    for rel_path in files:
+        stem = rel_path.rsplit(".", 1)[0]
+        for target in targets:
+            if matches(rel_path, target) or matches(stem, target) or matches(stem, f"{target}/__init__"):
+                imported.add(rel_path)
+                break
+    return imported
 
-def write_directory_to_clipboard(dir_path, ignore_dirs=None):
 
-    if ignore_dirs is None:
-        ignore_dirs = []
+# Orders the files by relevance: the current file, the files it imports, then the most recently modified
+def rank_files(root: Path, files: list, current_file: str = None) -> list:
+    current = None
+    imported = set()
+    if current_file:
+        current = Path(current_file).resolve()
+        try:
+            current = current.relative_to(root.resolve()).as_posix()
+            imported = find_imports((root / current).read_text(encoding="utf-8", errors="replace"), files)
+        except (ValueError, OSError):
+            current = None
 
-    output = []
+    def mtime(rel_path):
+        try:
+            return (root / rel_path).stat().st_mtime
+        except OSError:
+            return 0
 
-    output.append(
-        "This is my directory. The files are separated into folders when necessary. Give your answer considering the structure of the project."
-    )
+    return sorted(files, key=lambda rel_path: (rel_path != current, rel_path not in imported, -mtime(rel_path)))
 
-    for root, dirs, files in os.walk(dir_path):
-        # Check if the current directory should be ignored
-        dirs[:] = [d for d in dirs if d not in ignore_dirs]
 
-        # Get the depth of the directory to make a tree structure
-        level = root.replace(str(dir_path), '').count(os.sep)
-        indent = ' ' * 4 * level
-        output.append(f"{indent}{Path(root).name}/")
-        sub_indent = ' ' * 4 * (level + 1)
+# Reads a file as text, returning None for binaries and files over the size limit
+def read_text_file(path: Path, max_bytes: int = MAX_FILE_BYTES):
+    try:
+        if path.stat().st_size > max_bytes:
+            return None
+        data = path.read_bytes()
+    except OSError:
+        return None
 
-        # Write each file's content
-        for file_name in files:
-            file_path = Path(root) / file_name
-            output.append(f"{sub_indent}{file_name}")
-            output.append(f"{sub_indent}{'-'*20}")  # Divider for clarity
-            try:
-                with open(file_path, 'r') as file_content:
-                    output.append(file_content.read())
-            except Exception as e:
-                output.append(f"{sub_indent}Error reading file: {e}")
-            output.append(f"{sub_indent}{'-'*20}\n")  # End of file marker
+    # Files with NUL bytes or that are not valid UTF-8 are treated as binary
+    if b"\0" in data[:8192]:
+        return None
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+
+
+_encoding = None
+
+
+# Counts tokens with tiktoken, falling back to a rough estimate if the encoding is unavailable
+def count_tokens(text: str) -> int:
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+# Renders the list of relative paths as an indented directory tree
+def format_tree(root: Path, files: list) -> str:
+    lines = [f"{root.resolve().name}/"]
+    seen = set()
+    for rel_path in files:
+        parts = rel_path.split("/")
+        for depth in range(1, len(parts)):
+            directory = "/".join(parts[:depth])
+            if directory not in seen:
+                seen.add(directory)
+                lines.append(f"{' ' * 4 * depth}{parts[depth - 1]}/")
+        lines.append(f"{' ' * 4 * len(parts)}{parts[-1]}")
+    return "\n".join(lines)
+
+
+def iter_project_snapshot(dir_path,
+                          token_budget: int = DEFAULT_TOKEN_BUDGET,
+                          current_file: str = None,
+                          ignore: list = None,
+                          max_file_bytes: int = MAX_FILE_BYTES,
+                          workers: int = 8):
+    """
+    Streams a snapshot of the project: a header and directory tree, followed by the content of each file.
+
+    Args:
+        dir_path (str | Path): The project root.
+        token_budget (int, optional): Maximum number of tokens emitted. Files that don't fit in what is left are
+            skipped, smaller files ranked after them can still be included.
+        current_file (str, optional): The file open in the IDE; it and the files it imports are emitted first.
+        ignore (list, optional): Extra gitignore-style patterns applied to the whole project, on top of DEFAULT_IGNORE.
+        max_file_bytes (int, optional): Files larger than this are skipped.
+        workers (int, optional): Number of threads reading files concurrently.
+
+    Yields:
+        str: Chunks of the snapshot, in order.
+    """
+    root = Path(dir_path)
+    files = sorted(collect_files(root, ignore))
+
+    preamble = f"{HEADER}\n\n{format_tree(root, files)}\n\n"
+    used = count_tokens(preamble)
+    yield preamble
+
+    ranked = rank_files(root, files, current_file)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Keep a bounded window of reads in flight so we never read far past the budget
+        pending = deque()
+        remaining = iter(ranked)
+
+        def refill():
+            while len(pending) < workers * 2:
+                rel_path = next(remaining, None)
+                if rel_path is None:
+                    return
+                pending.append((rel_path, executor.submit(read_text_file, root / rel_path, max_file_bytes)))
+
+        refill()
+        processed = 0
+        omitted = 0
+        while pending:
+            # Nothing more fits: stop reading
+            if token_budget - used < MIN_CHUNK_TOKENS:
+                for _, future in pending:
+                    future.cancel()
+                omitted += len(ranked) - processed
+                break
+
+            rel_path, future = pending.popleft()
+            content = future.result()
+            processed += 1
+            refill()
+
+            # Skip binaries and large files
+            if content is None:
+                continue
+
+            chunk = f"{rel_path}\n{'-' * 20}\n{content}\n{'-' * 20}\n\n"
+            tokens = count_tokens(chunk)
+            # Too big for what is left of the budget, smaller files ranked after it may still fit
+            if used + tokens > token_budget:
+                omitted += 1
+                continue
+
+            used += tokens
+            yield chunk
+
+        if omitted:
+            yield f"[Token budget of {token_budget} reached, {omitted} files omitted]\n"
+
+
+def snapshot_project(dir_path, **kwargs) -> str:
+    """
+    Returns the whole snapshot as a single string. Accepts the same arguments as iter_project_snapshot.
+    """
+    return "".join(iter_project_snapshot(dir_path, **kwargs))
+
+
+def write_directory_to_clipboard(dir_path, ignore_dirs=None, **kwargs):
+
+    ignore = [f"{d.strip('/')}/" for d in ignore_dirs or []]
 
     # Copy the output to the clipboard
-    pyperclip.copy('\n'.join(output))
+    pyperclip.copy(snapshot_project(dir_path, ignore=ignore, **kwargs))
     print("Directory structure and content copied to clipboard.")
 
 
-# Usage example
-dir_path = Path('./')  # Replace with your directory path
-ignore_dirs = ['lib', 'node_modules', 'pack', 'venv', '.idea', '.run',
-               'gradle']  # Add any directories you want to ignore
-write_directory_to_clipboard(dir_path, ignore_dirs)
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Snapshot a project directory for the LLM.")
+    parser.add_argument("dir_path", nargs="?", default="./", help="Path to the project directory.")
+    parser.add_argument("--budget", type=int, default=DEFAULT_TOKEN_BUDGET, help="Maximum number of tokens.")
+    parser.add_argument("--current-file", default=None, help="File currently open in the IDE.")
+    parser.add_argument("--stdout", action="store_true", help="Stream to stdout instead of the clipboard.")
+    args = parser.parse_args()
+
+    if args.stdout:
+        for chunk in iter_project_snapshot(args.dir_path, token_budget=args.budget, current_file=args.current_file):
+            print(chunk, end="", flush=True)
+    else:
+        write_directory_to_clipboard(args.dir_path, token_budget=args.budget, current_file=args.current_file)
@@ -0,0 +1,107 @@
+"""
+Times an original and a candidate implementation inside the sandbox and checks that their outputs match.
+
+Usage: python3 benchmark.py config.json
+
+The config holds "mode" ("python" or "native"), "warmup", "repeat" and the "stdin" given to each run. In python
+mode "sources" maps original/candidate to their code and "driver" is the code timed against each of them (the
+whole source is timed when there is no driver). In native mode "commands" maps original/candidate to the
+command line of the compiled program. Results are printed as JSON after a marker line.
+"""
+
+import contextlib
+import io
+import json
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+
+MARKER = "@@BENCHMARK@@"
+IMPLEMENTATIONS = ("original", "candidate")
+
+
+def python_runner(source: str, driver: str, stdin: str):
+    # With a driver, the implementation is loaded once and only the driver is timed
+    namespace = {"__name__": "__main__"}
+    if driver:
+        exec(compile(source, "impl.py", "exec"), namespace)
+        statement = compile(driver, "driver.py", "exec")
+    else:
+        statement = compile(source, "impl.py", "exec")
+
+    def run():
+        scope = namespace if driver else {"__name__": "__main__"}
+        output = io.StringIO()
+        sys.stdin = io.StringIO(stdin)
+        with contextlib.redirect_stdout(output):
+            exec(statement, scope)
+        return output.getvalue()
+
+    return run
+
+
+def native_runner(command: list, stdin: str):
+
+    def run():
+        result = subprocess.run(command, input=stdin, capture_output=True, text=True, timeout=120)
+        if result.returncode != 0:
+            raise RuntimeError(f"exit code {result.returncode}: {result.stderr.strip()[-500:]}")
+        return result.stdout
+
+    return run
+
+
+def measure(run, warmup: int, repeat: int, number: int) -> dict:
+    for _ in range(warmup):
+        run()
+    times = [t / number for t in timeit.Timer(run, timer=time.perf_counter).repeat(repeat=repeat, number=number)]
+    return {
+        "mean": statistics.mean(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "min": min(times),
+        "max": max(times),
+        "repeat": repeat,
+        "number": number,
+    }
+
+
+def main():
+    with open(sys.argv[1], "r", encoding="utf-8") as file:
+        config = json.load(file)
+
+    stdin = config.get("stdin", "")
+    runners = {}
+    for name in IMPLEMENTATIONS:
+        if config["mode"] == "python":
+            runners[name] = python_runner(config["sources"][name], config.get("driver", ""), stdin)
+        else:
+            runners[name] = native_runner(config["commands"][name], stdin)
+
+    report = {}
+    outputs = {}
+    number = None
+    for name in IMPLEMENTATIONS:
+        try:
+            # The first run is not timed, it provides the output used for the equivalence check
+            outputs[name] = runners[name]()
+
+            # Pick the loop count on the original (timeit autorange style) and reuse it for the candidate
+            if number is None:
+                number = timeit.Timer(runners[name]).autorange()[0] if config["mode"] == "python" else 1
+            report[name] = measure(runners[name], config.get("warmup", 2), config.get("repeat", 7), number)
+        except Exception as e:
+            report[name] = {"error": f"{type(e).__name__}: {e}"}
+
+    if all("error" not in report[name] for name in IMPLEMENTATIONS):
+        report["outputs_match"] = outputs["original"] == outputs["candidate"]
+        report["speedup"] = report["original"]["mean"] / report["candidate"]["mean"]
+    report["outputs"] = {name: output[-1000:] for name, output in outputs.items()}
+
+    sys.stdin = sys.__stdin__
+    print(MARKER + json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""
+Runs a Python script under cProfile inside the sandbox and prints the per-function statistics as JSON.
+
+Usage: python3 profile_python.py <script> [args...]
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import runpy
+import sys
+
+MARKER = "@@PROFILE@@"
+
+target = sys.argv[1]
+sys.argv = sys.argv[1:]
+
+profiler = cProfile.Profile()
+exit_code = 0
+try:
+    profiler.runcall(runpy.run_path, target, run_name="__main__")
+except SystemExit as e:
+    # Same exit codes as the interpreter: sys.exit() and sys.exit(None) are 0, other non-integer codes are 1
+    exit_code = 0 if e.code is None else e.code if isinstance(e.code, int) else 1
+sys.stdout.flush()
+
+rows = []
+for (filename, line, function), (_, calls, exclusive, inclusive, _) in pstats.Stats(profiler).stats.items():
+    # Leave out the harness itself and the runpy machinery used to start the script
+    # (on 3.11+ runpy is a frozen module, its filename is "<frozen runpy>")
+    if filename.endswith(("runpy.py", "profile_python.py")) or filename == "<frozen runpy>":
+        continue
+    name = function if filename == "~" else f"{function} ({os.path.basename(filename)}:{line})"
+    rows.append({"function": name, "calls": calls, "exclusive": exclusive, "inclusive": inclusive})
+
+print(MARKER + json.dumps({"exit_code": exit_code, "rows": rows}))
@@ -0,0 +1,132 @@
+"""
+Shared model client for the supervisor and all the worker agents.
+
+Every ChatOpenAI instance is built on the same pair of pooled httpx clients, so the agents reuse keep-alive
+connections instead of each paying for its own connection setup. The async client sends everything through
+the SchedulingTransport (optional rate limits, retries, request coalescing). Token usage, including the prompt tokens
+served from the provider's prompt cache, is collected per agent.
+"""
+
+# General imports
+import os
+from collections import defaultdict
+import httpx
+
+# Langchain
+from langchain_openai import ChatOpenAI
+
+from scheduler import SchedulingTransport
+
+MODEL = "gpt-4o"
+
+# Connection pool shared by every model call
+POOL_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=120)
+TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+
+_http_client = None
+_http_async_client = None
+
+
+# Reads an optional client-side rate limit from the environment, None (no limit) if it is not set
+def rate_limit(name: str):
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+def get_http_clients() -> tuple:
+    """
+    Returns the shared (sync, async) httpx clients, creating them on first use.
+    """
+    global _http_client, _http_async_client
+
+    if _http_client is None:
+        _http_client = httpx.Client(limits=POOL_LIMITS, timeout=TIMEOUT)
+    if _http_async_client is None:
+        # Client-side throttling is opt-in: set OPENAI_REQUESTS_PER_MINUTE / OPENAI_TOKENS_PER_MINUTE to the
+        # limits of the API key (or a share of them if the key is shared). They are read here rather than at
+        # import time so that values loaded from .env by main() apply.
+        transport = SchedulingTransport(httpx.AsyncHTTPTransport(limits=POOL_LIMITS),
+                                        requests_per_minute=rate_limit("OPENAI_REQUESTS_PER_MINUTE"),
+                                        tokens_per_minute=rate_limit("OPENAI_TOKENS_PER_MINUTE"))
+        _http_async_client = httpx.AsyncClient(transport=transport, timeout=TIMEOUT)
+
+    return _http_client, _http_async_client
+
+
+async def close_http_clients():
+    """
+    Closes the shared httpx clients. They are recreated on the next call to get_http_clients.
+    """
+    global _http_client, _http_async_client
+
+    if _http_client is not None:
+        _http_client.close()
+    if _http_async_client is not None:
+        await _http_async_client.aclose()
+    _http_client, _http_async_client = None, None
+
+
+def get_chat_model(temperature: float, max_tokens: int, **kwargs) -> ChatOpenAI:
+    """
+    Creates a chat model that uses the shared connection pool.
+
+    The endpoint can be overridden with OPENAI_BASE_URL, e.g. to point the agents at a local stand-in server.
+    Retries are handled by the SchedulingTransport, so the OpenAI client's own retries are off by default.
+
+    Args:
+        temperature (float): Sampling temperature.
+        max_tokens (int): Maximum number of tokens in the completion.
+        **kwargs: Any other ChatOpenAI argument.
+
+    Returns:
+        ChatOpenAI: The model.
+    """
+    http_client, http_async_client = get_http_clients()
+    kwargs.setdefault("max_retries", 0)
+
+    return ChatOpenAI(model=MODEL,
+                      api_key=os.getenv("OPENAI_API_KEY"),
+                      base_url=os.getenv("OPENAI_BASE_URL"),
+                      temperature=temperature,
+                      max_tokens=max_tokens,
+                      http_client=http_client,
+                      http_async_client=http_async_client,
+                      **kwargs)
+
+
+class UsageTracker:
+    """
+    Accumulates token usage per agent, including the number of prompt tokens read from the prompt cache.
+    """
+
+    def __init__(self):
+        self.usage = defaultdict(lambda: {"calls": 0, "input": 0, "cached": 0, "output": 0})
+
+    def record(self, name: str, message) -> dict:
+        """
+        Records the usage reported on an AIMessage and returns the counts for this call.
+        """
+        metadata = getattr(message, "usage_metadata", None) or {}
+        call = {
+            "input": metadata.get("input_tokens", 0),
+            "cached": (metadata.get("input_token_details") or {}).get("cache_read") or 0,
+            "output": metadata.get("output_tokens", 0),
+        }
+
+        totals = self.usage[name]
+        totals["calls"] += 1
+        for key, value in call.items():
+            totals[key] += value
+
+        return call
+
+    def report(self) -> str:
+        lines = []
+        for name, totals in self.usage.items():
+            ratio = totals["cached"] / totals["input"] if totals["input"] else 0
+            lines.append(f"{name}: {totals['calls']} calls, {totals['input']} input tokens "
+                         f"({totals['cached']} cached, {ratio:.0%}), {totals['output']} output tokens")
+        return "\n".join(lines)
+
+
+usage_tracker = UsageTracker()
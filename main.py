@@ -3,37 +3,45 @@ Main implementation of the multi-agent copilot.
 """
 
 # General imports
-from typing import Annotated, Literal, TypedDict, Sequence, Callable, List
+from typing import Annotated, Literal, TypedDict, Callable, List
 from argparse import ArgumentParser
 import asyncio
 import os
 from langchain_core import messages
 from pydantic import BaseModel, Field
-import operator
 import functools
+import json
 from dotenv import load_dotenv
 import requests
 
 # Langchain
-from langchain_core.messages import AIMessage, HumanMessage, BaseMessage
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
 from langchain_core.tools import tool
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser
 
 # Langgraph
 from langgraph.graph import END, START, StateGraph
-from langgraph.prebuilt import ToolNode
 
 # Tools
-from tools import bing_search, run_python_docker, lint_python_docker, clean_c_docker, lint_c_docker, clean_cpp_docker, lint_cpp_docker
+from tools import bing_search, run_python_docker, lint_python_docker, clean_c_docker, lint_c_docker, clean_cpp_docker, lint_cpp_docker, profile_code, benchmark_code
+
+# Shared model client
+from llm import get_chat_model, close_http_clients, usage_tracker
+
+# Speculative tool execution and per-turn tool guard
+from speculation import Speculator
+from tool_guard import ToolGuard, DEFAULT_MAX_CALLS, DEFAULT_MAX_SECONDS
+
+# Compact message state
+from message_store import MessageLog, append_messages
 
 chat_history = []
 
 
-# Defining State
+# Defining State -> messages is an append-only log, so updates don't copy the history (see message_store.py)
 class AgentState(TypedDict):
-    messages: Annotated[Sequence[BaseMessage], operator.add]
+    messages: Annotated[MessageLog, append_messages]
     next: Literal["Checker", "Optimizer", "Sanitizer", "Helper", "END"]
     sender: Literal["Checker", "Optimizer", "Sanitizer", "Helper", "END"]
 
@@ -41,11 +49,13 @@ class AgentState(TypedDict):
 # Creating the agent -> Basically a model that can call tools and gives output in a specific manner
 def create_agent(tools: list, system_prompt: str):
 
-    model = ChatOpenAI(model="gpt-4o", api_key=os.getenv("OPENAI_API_KEY"), temperature=0.15, max_tokens=4000)
+    model = get_chat_model(temperature=0.15, max_tokens=4000)
 
     if len(tools) > 0:
         model = model.bind_tools(tools, tool_choice="auto")
 
+    # The static system prompt (and the tool schemas bound above) come before the conversation, so every call
+    # of this agent starts with the same prefix and can be served from the provider's prompt cache
     prompt = ChatPromptTemplate.from_messages([("system", "{system_prompt}"),
                                                MessagesPlaceholder(variable_name="messages")
                                               ]).partial(system_prompt=system_prompt)
@@ -59,18 +69,54 @@ def create_agent(tools: list, system_prompt: str):
 # Defining the agent node -> Basically to define a node you have to have a function with a state parameter and
 async def agent_node(state, agent, name):
 
-    result = await agent.ainvoke(state)
+    result = await agent.ainvoke({"messages": state["messages"].view()})
     #print(f"\n\n {result.content} \n\n")
 
-    if result.tool_calls:
-        # print(result)
-        pass
-    else:
-        result = AIMessage(content=result.content, name=name)
+    usage = usage_tracker.record(name, result)
+    print(f"{name}: {usage['input']} input tokens ({usage['cached']} cached), {usage['output']} output tokens")
+
+    # Tag the message with the agent name in place instead of re-wrapping it
+    result.name = name
 
     return {"messages": [result], "sender": name}
 
 
+# Defining the tool node -> Executes the tool calls of the last message, using speculative results when they match
+# and memoized results for repeated calls, within the budget of the turn
+async def tool_node(state, tools, speculator=None, guard=None):
+
+    tools_by_name = {t.name: t for t in tools}
+
+    async def execute(call):
+        output = None
+        if speculator is not None:
+            output = await speculator.claim(call)
+
+        if output is None:
+            if call["name"] not in tools_by_name:
+                output = f"Error: {call['name']} is not a valid tool, try one of {list(tools_by_name)}."
+            else:
+                try:
+                    output = await tools_by_name[call["name"]].ainvoke(call["args"])
+                except Exception as e:
+                    output = f"Error: {repr(e)}\n Please fix your mistakes."
+        return output
+
+    async def run_call(call):
+        if guard is not None:
+            output = await guard.run(call, lambda: execute(call))
+        else:
+            output = await execute(call)
+
+        content = output if isinstance(output, str) else json.dumps(output, ensure_ascii=False)
+        return ToolMessage(content=content, name=call["name"], tool_call_id=call["id"])
+
+    tool_calls = state["messages"][-1].tool_calls
+    results = await asyncio.gather(*(run_call(call) for call in tool_calls))
+
+    return {"messages": list(results)}
+
+
 def parse_chat_history(file_path: str) -> List:
     """
     Parse chat history from the given file and separate messages into HumanMessage and AIMessage.
@@ -88,7 +134,10 @@ def parse_chat_history(file_path: str) -> List:
     return messages
 
 
-async def main(file_path: str):
+async def main(file_path: str,
+               speculative: bool = False,
+               max_tool_calls: int = DEFAULT_MAX_CALLS,
+               max_tool_seconds: float = DEFAULT_MAX_SECONDS):
 
     message_list = parse_chat_history(file_path)
 
@@ -99,19 +148,22 @@ async def main(file_path: str):
     load_dotenv(dotenv_path=env_path)
 
     # Define the model for the supervisor
-    model = ChatOpenAI(model="gpt-4o",
-                       api_key=os.getenv("OPENAI_API_KEY"),
-                       max_retries=1,
-                       max_tokens=5000,
-                       temperature=0.25)
+    model = get_chat_model(max_tokens=5000, temperature=0.25)
 
     # Define worker nodes
     workers = ["Linter", "Optimizer", "Sanitizer", "Helper"]
 
+    # The static routing guidance is part of the leading system prompt so it is covered by the prompt cache
     supervisor_system_prompt = (
         "You are a supervisor in the context of a multi-agent coding copilot for Jetbrains IDEs."
         "You are responsible for overseeing the work of the following agents: {workers}"
         "Given the following user request, respond with the worker to act next. Each worker will perform a task and respond with their results and status. When finished, respond with FINISH."
+        """ Keep the following in mind:
+                The sanitizer is supposed to find errors in the code. It will compile the code and run code sanitizers such as Valgrind.
+                The optimizer is a general solution that should be used when the user wants to generate code, optimize an existing piece of code or wants an explanation for a piece of code.
+                The linter is going to run linters in the background to clean up the code, while additionally checking for style issues. 
+                The helper is supposed to answer questions about Jetbrains or general questions the user might ask that are unrelated to code.
+                """
     )
 
     class routeResponse(BaseModel):
@@ -120,20 +172,24 @@ async def main(file_path: str):
     supervisorPrompt = ChatPromptTemplate.from_messages([
         ("system", supervisor_system_prompt),
         MessagesPlaceholder(variable_name="messages"),
-        ("system", """ Given the conversation above, who should act next? Keep the following in mind: /
-                The sanitizer is supposed to find errors in the code. It will compile the code and run code sanitizers such as Valgrind.
-                The optimizer is a general solution that should be used when the user wants to generate code, optimize an existing piece of code or wants an explanation for a piece of code.
-                The linter is going to run linters in the background to clean up the code, while additionally checking for style issues. 
-                The helper is supposed to answer questions about Jetbrains or general questions the user might ask that are unrelated to code.
-                Select one of: {workers}
-                """)
+        ("system", "Given the conversation above, who should act next? Select one of: {workers}")
     ]).partial(workers=str(workers))
 
     # Supervisor is a node that routes the conversation to the next worker
+    supervisor_chain = supervisorPrompt | model.with_structured_output(routeResponse, include_raw=True)
+
+    # In speculative mode, lint/sanitize runs for attached code are started before the supervisor answers
+    speculator = Speculator() if speculative else None
+
+    # Identical tool calls are only executed once per turn, and the turn has a tool call and wall time budget
+    guard = ToolGuard(max_calls=max_tool_calls, max_seconds=max_tool_seconds)
+
     async def supervisor_agent(state):
-        supervisor_chain = supervisorPrompt | model.with_structured_output(routeResponse)
-        response = await supervisor_chain.ainvoke(state)
-        return response
+        response = await supervisor_chain.ainvoke({"messages": state["messages"].view()})
+        usage_tracker.record("Supervisor", response["raw"])
+        if speculator is not None:
+            speculator.route(response["parsed"].next)
+        return response["parsed"]
 
     ### Creating Agents -> Using functools.partial to set agent and name parameters ###
     linter_prompt = """You are a linter agent. You are responsible for running linters in the background to find style errors. Follow the steps below: 
@@ -147,12 +203,19 @@ async def main(file_path: str):
                                                         linter_prompt),
                                      name="Linter")
 
-    optimizer_prompt = "You are an optimizer agent. You are a general solution that should be used when the user wants to generate code, optimize an existing piece of code or wants an explanation for a piece of code."
-    optimizer_agent = functools.partial(agent_node, agent=create_agent([], optimizer_prompt), name="Optimizer")
+    optimizer_prompt = """You are an optimizer agent. You are a general solution that should be used when the user wants to generate code, optimize an existing piece of code or wants an explanation for a piece of code.
+    When you are asked to optimize code, do the following steps:
+    1 - Run the profile_code tool on the code to find where the time is actually spent. If the code has no driver code (e.g. only function definitions), add a small realistic main/driver for profiling.
+    2 - Base your optimizations on the measured hotspots, and tell the user which functions dominate the runtime.
+    3 - Run the benchmark_code tool with the original code and your optimized version to check that it is actually faster and produces the same output. Only present the rewrite as an improvement if the benchmark confirms it, and report the measured speedup."""
+    optimizer_agent = functools.partial(agent_node,
+                                        agent=create_agent([profile_code, benchmark_code], optimizer_prompt),
+                                        name="Optimizer")
 
     sanitizer_prompt = """You are a sanitizer agent. You are responsible for finding errors in the code. Do the following steps:
     1 - You will compile the code and run the code based on which programming language it is. This is a dict based on language and tool name: {"c" : "clean_c_docker", "c++" : "clean_cpp_docker", "python" : "run_python_docker"}.
-    2 - Make sure you provide to the user a simplified version of the output of the sanitizer tool."""
+    2 - Make sure you provide to the user a simplified version of the output of the sanitizer tool.
+    3 - For C/C++ the checks run in tiers and stop at the first problem found. Only set leak_detail to true if the user asks where a memory leak comes from."""
     sanitizer_agent = functools.partial(agent_node,
                                         agent=create_agent([clean_c_docker, clean_cpp_docker, run_python_docker],
                                                            sanitizer_prompt),
@@ -178,10 +241,16 @@ async def main(file_path: str):
     graph.add_conditional_edges("Supervisor", choose_agent, conditional_map)
 
     # Setup Tools
-    sanitizer_tools = ToolNode([clean_c_docker, clean_cpp_docker, run_python_docker])
-    optimizer_tools = ToolNode([])
-    linter_tools = ToolNode([lint_c_docker, lint_cpp_docker, lint_python_docker])
-    helper_tools = ToolNode([bing_search])
+    sanitizer_tools = functools.partial(tool_node,
+                                        tools=[clean_c_docker, clean_cpp_docker, run_python_docker],
+                                        speculator=speculator,
+                                        guard=guard)
+    optimizer_tools = functools.partial(tool_node, tools=[profile_code, benchmark_code], guard=guard)
+    linter_tools = functools.partial(tool_node,
+                                     tools=[lint_c_docker, lint_cpp_docker, lint_python_docker],
+                                     speculator=speculator,
+                                     guard=guard)
+    helper_tools = functools.partial(tool_node, tools=[bing_search], guard=guard)
 
     graph.add_node("SanitizerTools", sanitizer_tools)
     graph.add_node("OptimizerTools", optimizer_tools)
@@ -193,6 +262,10 @@ async def main(file_path: str):
         last_message = messages[-1]
 
         if last_message.tool_calls:
+            # The agent was already told the budget is spent and keeps calling tools, so stop the turn
+            if guard.refused:
+                print(f"Stopping {state['sender']}: {guard.exhausted}")
+                return "END"
             return state["next"] + "Tools"
 
         return "END"
@@ -211,7 +284,19 @@ async def main(file_path: str):
 
     workflow = graph.compile()
 
-    response = await workflow.ainvoke({"messages": message_list})
+    if speculator is not None:
+        speculator.start(message_list)
+
+    try:
+        response = await workflow.ainvoke({"messages": message_list})
+    finally:
+        if speculator is not None:
+            await speculator.cancel_all()
+        print(usage_tracker.report())
+        print(guard.report())
+        if speculator is not None:
+            print(speculator.report())
+        await close_http_clients()
 
     # message_history = []
     # while True:
@@ -221,14 +306,28 @@ async def main(file_path: str):
     #     message_history = response["messages"]
     #     response_text = response["messages"][-1].content
     #     print(f"Response: {response_text}")
-    print(response["messages"][-1].content)
-    return response["messages"][-1].content
+    last_message = response["messages"][-1]
+    content = last_message.content
+    if getattr(last_message, "tool_calls", None):
+        content = f"{content}\n\n(Stopped early: {guard.exhausted}.)".strip()
+
+    print(content)
+    return content
 
 
 # Run main with asyncio
 if __name__ == "__main__":
     parser = ArgumentParser(description="Run the chatbot with an initial input file.")
     parser.add_argument("file_path", help="Path to the chat history file.")
+    parser.add_argument("--speculative", action="store_true",
+                        help="Start lint/sanitize runs for attached code while the supervisor is routing.")
+    parser.add_argument("--max-tool-calls", type=int, default=DEFAULT_MAX_CALLS,
+                        help="Maximum number of tool executions per turn.")
+    parser.add_argument("--max-tool-seconds", type=float, default=DEFAULT_MAX_SECONDS,
+                        help="Wall time budget in seconds after which no more tools are executed.")
     args = parser.parse_args()
 
-    asyncio.run(main(args.file_path))
+    asyncio.run(main(args.file_path,
+                     speculative=args.speculative,
+                     max_tool_calls=args.max_tool_calls,
+                     max_tool_seconds=args.max_tool_seconds))
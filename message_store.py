@@ -0,0 +1,213 @@
+"""
+Compact, append-only message state for the graph.
+
+With the operator.add reducer every node update concatenated the whole history into a new list, so long
+Sanitizer <-> SanitizerTools loops copied the growing history at every step. Here the history lives in an
+append-only MessageStore and the graph state only holds a MessageLog: a (store, length) handle that is
+O(1) to extend and never copies earlier messages.
+
+Large payloads (tool outputs, whole-file contexts) are interned by content hash, so identical payloads are
+kept in memory once and can be referenced by id. Agents read the history through view(), which returns
+the messages as a list: every interned payload is labelled with its id where it first appears, and later
+repeats are replaced by a short reference to that id. Both are decided when the message is added, so a
+message never changes once it is in the prompt and the history stays a stable, cacheable prefix.
+"""
+
+# General imports
+import hashlib
+import json
+import time
+import tracemalloc
+from collections import namedtuple
+from collections.abc import Sequence
+from argparse import ArgumentParser
+
+# Langchain
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage, messages_to_dict
+
+# Payloads larger than this many characters are interned and can be referenced by id
+INLINE_LIMIT = 1024
+
+# compact is what view() shows instead of the message: the message labelled with its payload id for the first
+# occurrence of a payload, a reference to that id for the later ones
+Record = namedtuple("Record", ["message", "payload_id", "compact"])
+
+
+def payload_id(content: str) -> str:
+    return hashlib.sha1(content.encode("utf-8", errors="replace")).hexdigest()[:12]
+
+
+class MessageStore:
+    """
+    Append-only list of messages plus the table of interned payloads.
+    """
+
+    def __init__(self, inline_limit: int = INLINE_LIMIT, payloads: dict = None, records: list = None):
+        self.inline_limit = inline_limit
+        self.payloads = {} if payloads is None else payloads
+        self.records = [] if records is None else records
+        self.seen = {record.payload_id for record in self.records if record.payload_id is not None}
+
+    def add(self, messages: list):
+        for message in messages:
+            content = message.content
+            pid = None
+            compact = None
+            if isinstance(content, str) and len(content) > self.inline_limit:
+                pid = payload_id(content)
+                stored = self.payloads.setdefault(pid, content)
+                # Same payload already stored: point the message at the stored copy so this one can be freed
+                if stored is not content:
+                    message = message.model_copy(update={"content": stored})
+                if pid in self.seen:
+                    compact = message.model_copy(update={
+                        "content": f"[Identical to earlier content #{pid}, {len(content)} characters, not repeated]"})
+                else:
+                    # The label is a separate text block, so the payload string is shared rather than copied
+                    compact = message.model_copy(update={"content": [{"type": "text", "text": f"[Content #{pid}]\n"},
+                                                                     {"type": "text", "text": stored}]})
+                self.seen.add(pid)
+            self.records.append(Record(message, pid, compact))
+
+    def fork(self, length: int):
+        # Payloads are immutable, so the forked store can share them
+        return MessageStore(self.inline_limit, self.payloads, self.records[:length])
+
+
+class MessageLog(Sequence):
+    """
+    The first `length` messages of a MessageStore. Used as the value of AgentState.messages.
+    """
+
+    def __init__(self, store: MessageStore = None, length: int = 0):
+        self.store = MessageStore() if store is None else store
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [record.message for record in self.store.records[:self.length][index]]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("message index out of range")
+        return self.store.records[index].message
+
+    def __iter__(self):
+        records = self.store.records
+        for index in range(self.length):
+            yield records[index].message
+
+    def append(self, messages) -> "MessageLog":
+        """
+        Returns a new log with the messages appended; this log stays unchanged.
+        """
+        if isinstance(messages, BaseMessage):
+            messages = [messages]
+        messages = list(messages)
+        store, length = self.store, self.length
+
+        if len(store.records) == length:
+            store.add(messages)
+        elif not self.already_stored(messages):
+            # The store was extended past this log with different messages: branch off
+            store = store.fork(length)
+            store.add(messages)
+
+        return MessageLog(store, length + len(messages))
+
+    def already_stored(self, messages: list) -> bool:
+        # LangGraph applies a node's writes to a throwaway copy of the state before routing, so the same update
+        # can arrive twice; the second time it is already in the store right after this log
+        records = self.store.records[self.length:self.length + len(messages)]
+        if len(records) != len(messages):
+            return False
+        for record, message in zip(records, messages):
+            if record.message is not message and (type(record.message) is not type(message)
+                                                  or record.message.content != message.content
+                                                  or record.message.id != message.id):
+                return False
+        return True
+
+    def payload(self, pid: str) -> str:
+        return self.store.payloads[pid]
+
+    def view(self, dedupe: bool = True) -> list:
+        """
+        Returns the messages as a list for the prompt. With dedupe, interned payloads are labelled
+        "[Content #<id>]" where they first appear and replaced by a reference to that id when they repeat.
+        """
+        records = self.store.records[:self.length]
+        if not dedupe:
+            return [record.message for record in records]
+        return [record.compact or record.message for record in records]
+
+
+# Reducer for AgentState.messages
+def append_messages(log, messages):
+    if not isinstance(log, MessageLog):
+        log = MessageLog().append(log or [])
+    if isinstance(messages, MessageLog):
+        messages = list(messages)
+    return log.append(messages)
+
+
+# Simulates a long tool loop and compares the operator.add list state with the MessageLog state
+def measure(steps: int, output_size: int, group: int, sample_every: int = 10):
+    context = "int main() { return 0; }\n" * (output_size // 25)
+
+    def session():
+        # A tool call and a tool output per step; consecutive tool outputs are identical in groups of `group`
+        yield [HumanMessage(content=f"Context: {context} User Input: find the bug")]
+        for step in range(steps):
+            call = {"name": "clean_c_docker", "args": {"code": "...", "params": []}, "id": f"call_{step}"}
+            yield [AIMessage(content="", tool_calls=[call])]
+            seed = step - step % group
+            output = "".join(f"==1== line {seed} {i}\n" for i in range(output_size // 20))
+            yield [ToolMessage(content=output, tool_call_id=f"call_{step}")]
+
+    print(f"{steps} steps, {output_size} byte tool outputs, identical outputs in groups of {group}")
+
+    for name, state, reduce, read in (("operator.add", [], lambda left, right: left + right, list),
+                                      ("MessageLog", MessageLog(), append_messages, lambda log: log.view())):
+        update_time = read_time = serialize_time = request_bytes = 0.0
+        samples = 0
+
+        tracemalloc.start()
+        for index, update in enumerate(session()):
+            start = time.perf_counter()
+            state = reduce(state, update)
+            update_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            messages = read(state)
+            read_time += time.perf_counter() - start
+
+            # What the agent serialises for its next model request, sampled because it grows with the history
+            if index % sample_every == 0:
+                start = time.perf_counter()
+                request_bytes += len(json.dumps(messages_to_dict(messages)))
+                serialize_time += time.perf_counter() - start
+                samples += 1
+        del messages
+        retained, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        updates = index + 1
+        print(f"  {name:>12}: state {retained / 1e6:7.2f} MB, "
+              f"update {update_time / updates * 1e6:6.1f} us/step, view {read_time / updates * 1e6:6.1f} us/step, "
+              f"request {request_bytes / samples / 1e6:6.2f} MB and {serialize_time / samples * 1e3:6.1f} ms/step")
+        del state
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Measure the message state on a long synthetic session.")
+    parser.add_argument("--steps", type=int, default=500, help="Number of tool calls in the session.")
+    parser.add_argument("--output-size", type=int, default=20_000, help="Size of each tool output in bytes.")
+    parser.add_argument("--group", type=int, default=4,
+                        help="Consecutive tool outputs are identical in groups of this size (1: all distinct).")
+    args = parser.parse_args()
+
+    measure(args.steps, args.output_size, args.group)
@@ -0,0 +1,193 @@
+"""
+Shared sandbox layer used by the tools to ship code into the cleaner-tool container.
+
+Source files are packed into an in-memory tar archive and copied straight into the container with
+put_archive, so no temporary files are written on the host and the code never passes through a shell.
+"""
+
+# General imports
+import contextvars
+import io
+import tarfile
+import threading
+import time
+import uuid
+import docker
+
+from utils import clean_logs
+
+IMAGE = "tomassoares/jetbrains-cleaner-tool:latest"
+
+# Exit code of coreutils timeout when it had to kill the command
+TIMEOUT_EXIT_CODE = 124
+
+
+class SandboxCancelled(Exception):
+    pass
+
+
+class CancelScope:
+    """
+    Groups the sandboxes started while the scope is active, so they can be killed from another thread.
+
+    Activate a scope with cancel_scope.set(scope); asyncio.to_thread carries it into the worker thread. Once
+    cancelled, running containers are removed and starting new sandboxes raises SandboxCancelled.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self.sandboxes = set()
+        self.lock = threading.Lock()
+
+    def register(self, sandbox):
+        with self.lock:
+            if self.cancelled:
+                raise SandboxCancelled("Sandbox run was cancelled")
+            self.sandboxes.add(sandbox)
+
+    def unregister(self, sandbox):
+        with self.lock:
+            self.sandboxes.discard(sandbox)
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            sandboxes = list(self.sandboxes)
+        for sandbox in sandboxes:
+            sandbox.close()
+
+
+cancel_scope = contextvars.ContextVar("cancel_scope", default=None)
+
+
+# Packs a {relative path: content} dict into an in-memory tar archive rooted at the given directory
+def pack_files(files: dict, root: str) -> bytes:
+    """
+    Builds a tar archive in memory containing the given files under a single root directory.
+
+    Args:
+        files (dict): Maps relative file paths (e.g. "main.c", "include/util.h") to their content (str or bytes).
+        root (str): Name of the directory the files are placed in inside the archive.
+
+    Returns:
+        bytes: The raw tar archive.
+    """
+    buffer = io.BytesIO()
+    now = time.time()
+
+    with tarfile.open(fileobj=buffer, mode="w") as archive:
+        # Root directory entry, so the job directory exists with sane permissions inside the container
+        root_info = tarfile.TarInfo(root)
+        root_info.type = tarfile.DIRTYPE
+        root_info.mode = 0o777
+        root_info.mtime = now
+        archive.addfile(root_info)
+
+        for name, content in files.items():
+            name = name.lstrip("/")
+            if not name or ".." in name.split("/"):
+                raise ValueError(f"Invalid file name for sandbox payload: {name!r}")
+
+            data = content.encode("utf-8") if isinstance(content, str) else content
+            info = tarfile.TarInfo(f"{root}/{name}")
+            info.size = len(data)
+            info.mode = 0o666
+            info.mtime = now
+            archive.addfile(info, io.BytesIO(data))
+
+    return buffer.getvalue()
+
+
+class Sandbox:
+    """
+    A temporary container with a set of source files copied into its working directory.
+
+    Used as a context manager: the container is started and populated on enter and force-removed on exit.
+
+        with Sandbox({"main.py": code}) as sandbox:
+            exit_code, logs = sandbox.exec(["python3", "main.py"])
+    """
+
+    def __init__(self, files: dict, image: str = IMAGE):
+        self.files = files
+        self.image = image
+        self.workdir = f"/tmp/{uuid.uuid4().hex}"
+        self.container = None
+        self.scope = cancel_scope.get()
+
+    def __enter__(self):
+        if self.scope is not None:
+            self.scope.register(self)
+
+        client = docker.from_env()
+
+        # Start the container with a long-running process so several commands can be executed in it
+        self.container = client.containers.run(image=self.image,
+                                               command="sleep infinity",
+                                               detach=True,
+                                               tty=True,
+                                               stdin_open=True)
+        try:
+            # The scope may have been cancelled while the container was starting
+            if self.scope is not None and self.scope.cancelled:
+                raise SandboxCancelled("Sandbox run was cancelled")
+
+            archive = pack_files(self.files, self.workdir.rsplit("/", 1)[-1])
+            if not self.container.put_archive("/tmp", archive):
+                raise RuntimeError("Failed to copy the source files into the container")
+        except Exception:
+            self.close()
+            raise
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def exec(self, command: list, timeout: int = None, environment: dict = None) -> tuple:
+        """
+        Runs a command inside the sandbox working directory.
+
+        Args:
+            command (list): The command and its arguments. Arguments are passed as-is, without a shell.
+            timeout (int, optional): Kills the command after this many seconds (exit code 124, see TIMEOUT_EXIT_CODE).
+            environment (dict, optional): Extra environment variables for the command.
+
+        Returns:
+            tuple: The exit code (int) and the cleaned up combined stdout/stderr (str).
+        """
+        if timeout:
+            command = ["timeout", str(timeout)] + list(command)
+
+        result = self.container.exec_run(command, workdir=self.workdir, environment=environment,
+                                         stdout=True, stderr=True)
+        return result.exit_code, clean_logs(result.output.decode("utf-8", errors="replace"))
+
+    def close(self):
+        # Clean up: kill and remove the container, safe to call more than once and from another thread
+        container, self.container = self.container, None
+        if container is not None:
+            try:
+                container.remove(force=True)
+            except Exception:
+                pass
+        if self.scope is not None:
+            self.scope.unregister(self)
+
+
+# Convenience wrapper for the common single-command case
+def run_in_sandbox(files: dict, command: list, timeout: int = None) -> tuple:
+    """
+    Copies the files into a fresh container, runs one command and removes the container.
+
+    Args:
+        files (dict): Maps relative file paths to their content.
+        command (list): The command and its arguments.
+        timeout (int, optional): Kills the command after this many seconds.
+
+    Returns:
+        tuple: The exit code (int) and the cleaned up output (str).
+    """
+    with Sandbox(files) as sandbox:
+        return sandbox.exec(command, timeout=timeout)
@@ -0,0 +1,174 @@
+"""
+Client-side scheduler for the model requests.
+
+SchedulingTransport sits under the shared httpx client (see llm.py), so every model call goes through it:
+  - optional token buckets keep us under the requests-per-minute and tokens-per-minute limits,
+  - 429s, 5xx and connection errors are retried with jittered exponential backoff, honouring Retry-After,
+  - identical requests that are in flight at the same time are sent once and share the response.
+"""
+
+# General imports
+import asyncio
+import email.utils
+import hashlib
+import json
+import random
+import time
+import httpx
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate_per_minute, holding at most one minute worth of tokens.
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float):
+        # Requests bigger than the bucket are let through once it is full, otherwise they would wait forever
+        amount = min(amount, self.capacity)
+
+        # The lock keeps waiters in FIFO order
+        async with self.lock:
+            self.refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= amount
+
+
+# Reads the delay requested by the server from Retry-After / retry-after-ms, in seconds
+def retry_after(headers) -> float:
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    # HTTP date; anything else is ignored and the caller falls back to its own backoff
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+# Rough token cost of a chat completion request: the prompt size plus the completion budget
+def estimate_tokens(body: bytes) -> int:
+    try:
+        payload = json.loads(body)
+        prompt = json.dumps(payload.get("messages", ""))
+        return len(prompt) // 4 + int(payload.get("max_tokens") or payload.get("max_completion_tokens") or 0)
+    except (ValueError, TypeError, AttributeError):
+        return len(body) // 4
+
+
+class SchedulingTransport(httpx.AsyncBaseTransport):
+
+    def __init__(self,
+                 transport: httpx.AsyncBaseTransport,
+                 requests_per_minute: float = None,
+                 tokens_per_minute: float = None,
+                 max_retries: int = 6,
+                 base_delay: float = 1.0,
+                 max_delay: float = 60.0):
+        self.transport = transport
+        # No bucket means no client-side limit, the server's 429s are still honoured
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.paused_until = 0.0
+        self.in_flight = {}
+        self.stats = {"sent": 0, "retried": 0, "coalesced": 0}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        key = hashlib.sha256(request.method.encode() + str(request.url).encode() + body).hexdigest()
+
+        # Identical request already in flight: wait for its response instead of sending another one
+        if key in self.in_flight:
+            self.stats["coalesced"] += 1
+            status_code, headers, content = await asyncio.shield(self.in_flight[key])
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.in_flight[key] = future
+            try:
+                status_code, headers, content = await self.send(request, body)
+                future.set_result((status_code, headers, content))
+            except BaseException as e:
+                future.set_exception(e)
+                # Mark the exception as retrieved in case nobody else was waiting on it
+                future.exception()
+                raise
+            finally:
+                del self.in_flight[key]
+
+        return httpx.Response(status_code, headers=headers, content=content, request=request)
+
+    def backoff(self, attempt: int) -> float:
+        # Full jitter: a random delay between 0 and the exponential cap
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def send(self, request: httpx.Request, body: bytes) -> tuple:
+        tokens = estimate_tokens(body)
+
+        for attempt in range(self.max_retries + 1):
+            # A 429 on any request pauses all of them until the server's retry delay has passed
+            pause = self.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+
+            if self.request_bucket is not None:
+                await self.request_bucket.acquire(1)
+            if self.token_bucket is not None:
+                await self.token_bucket.acquire(tokens)
+
+            self.stats["sent"] += 1
+            try:
+                response = await self.transport.handle_async_request(request)
+                content = b"".join([chunk async for chunk in response.aiter_raw()])
+                await response.aclose()
+            except httpx.TransportError:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    return response.status_code, response.headers, content
+
+                server_delay = retry_after(response.headers)
+                if server_delay is not None:
+                    delay = min(self.max_delay, server_delay) + random.uniform(0, self.base_delay / 4)
+                else:
+                    delay = self.backoff(attempt)
+                if response.status_code == 429:
+                    self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+            self.stats["retried"] += 1
+            print(f"Model request failed (attempt {attempt + 1}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        await self.transport.aclose()
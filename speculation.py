@@ -0,0 +1,139 @@
+"""
+Speculative tool execution.
+
+When the user attaches a file, the lint and sanitize runs for its language are started in the background
+while the supervisor is still routing. If the worker later calls the same tool with the same code, the
+prefetched result is handed back; runs that end up unused are cancelled and their containers removed.
+"""
+
+# General imports
+import asyncio
+
+# Langchain
+from langchain_core.messages import HumanMessage
+
+# Tools
+from tools import run_python_docker, lint_python_docker, clean_c_docker, lint_c_docker, clean_cpp_docker, lint_cpp_docker
+from sandbox import CancelScope, cancel_scope
+from utils import trim_md, extract_context, detect_language
+
+# Tools to prefetch per worker and language
+WORKER_TOOLS = {
+    "Linter": {"c": lint_c_docker, "c++": lint_cpp_docker, "python": lint_python_docker},
+    "Sanitizer": {"c": clean_c_docker, "c++": clean_cpp_docker, "python": run_python_docker},
+}
+
+
+# Normalizes code so that trailing whitespace and surrounding blank lines don't prevent a match
+def normalize_code(code: str) -> str:
+    return "\n".join(line.rstrip() for line in trim_md(code).strip().splitlines())
+
+
+class SpeculativeRun:
+
+    def __init__(self, worker: str, tool, code: str):
+        self.worker = worker
+        self.tool = tool
+        self.code = normalize_code(code)
+        self.scope = CancelScope()
+        self.task = asyncio.create_task(self.run(code))
+
+    async def run(self, code: str):
+        # The task has its own context, so the scope only applies to the sandboxes started by this run
+        cancel_scope.set(self.scope)
+        args = {"code": code}
+        if "params" in self.tool.args:
+            args["params"] = []
+        return await asyncio.to_thread(self.tool.invoke, args)
+
+    def matches(self, call: dict) -> bool:
+        args = call["args"]
+        if call["name"] != self.tool.name or normalize_code(args.get("code", "")) != self.code:
+            return False
+
+        # Every other argument must be left at the value the speculative run used
+        for key, value in args.items():
+            if key == "code" or (key in ("params", "files") and not value):
+                continue
+            if value != self.tool.args.get(key, {}).get("default"):
+                return False
+        return True
+
+    def cancel(self) -> asyncio.Task:
+        # Removing the containers blocks on the Docker API, so it runs in a thread instead of the event loop
+        cleanup = asyncio.create_task(asyncio.to_thread(self.scope.cancel))
+        self.task.cancel()
+        return cleanup
+
+
+class Speculator:
+    """
+    Starts and tracks the speculative tool runs of a single turn.
+    """
+
+    def __init__(self):
+        self.runs = []
+        self.cleanups = []
+        self.hits = 0
+
+    def start(self, messages: list):
+        """
+        Starts the lint and sanitize runs for the code attached to the last user message, if any.
+        """
+        last_human = next((m for m in reversed(messages) if isinstance(m, HumanMessage)), None)
+        if last_human is None:
+            return
+
+        code = extract_context(last_human.content)
+        language = detect_language(code) if code else None
+        if language is None:
+            return
+
+        for worker, tools in WORKER_TOOLS.items():
+            print(f"Speculatively running {tools[language].name}")
+            self.runs.append(SpeculativeRun(worker, tools[language], code))
+
+    def route(self, worker: str):
+        """
+        Cancels the runs that the selected worker will not use.
+        """
+        for run in [run for run in self.runs if run.worker != worker]:
+            self.cleanups.append(run.cancel())
+            self.runs.remove(run)
+
+    async def claim(self, call: dict):
+        """
+        Returns the prefetched result for a tool call, or None if no speculative run matches it.
+        """
+        for run in self.runs:
+            if run.matches(call):
+                self.runs.remove(run)
+                try:
+                    result = await run.task
+                except asyncio.CancelledError:
+                    return None
+                self.hits += 1
+                print(f"Using speculative result for {call['name']}")
+                return result
+
+            # The worker called the tool with different arguments, the prefetched run is useless
+            if call["name"] == run.tool.name:
+                self.cleanups.append(run.cancel())
+                self.runs.remove(run)
+                return None
+
+        return None
+
+    async def cancel_all(self):
+        """
+        Cancels the runs that are left and waits until all the cancelled runs have removed their containers.
+        """
+        for run in self.runs:
+            self.cleanups.append(run.cancel())
+        self.runs = []
+
+        await asyncio.gather(*self.cleanups, return_exceptions=True)
+        self.cleanups = []
+
+    def report(self) -> str:
+        return f"Speculation: {self.hits} prefetched results used"
@@ -0,0 +1,94 @@
+"""
+The supervisor and the workers share one pooled connection and report the prompt tokens served from the cache.
+Runs against a local stand-in for the OpenAI API, selected with OPENAI_BASE_URL.
+"""
+
+# General imports
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Literal
+import pytest
+from pydantic import BaseModel
+
+# Langchain
+from langchain_core.messages import HumanMessage
+
+import llm
+
+
+class FakeOpenAI(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    clients = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.clients.append(self.client_address)
+
+        message = {"role": "assistant", "content": "Done."}
+        if body.get("tools") and body["tools"][0]["function"]["name"] == "routeResponse":
+            message = {"role": "assistant", "content": None, "tool_calls": [{
+                "id": "call_1", "type": "function",
+                "function": {"name": "routeResponse", "arguments": json.dumps({"next": "Optimizer"})}}]}
+
+        content = json.dumps({
+            "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": llm.MODEL,
+            "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1500, "completion_tokens": 20, "total_tokens": 1520,
+                      "prompt_tokens_details": {"cached_tokens": 1024}},
+        }).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    FakeOpenAI.clients = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FakeOpenAI)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{httpd.server_port}/v1")
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    yield FakeOpenAI
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_agents_share_connection_and_report_cached_tokens(server):
+
+    class routeResponse(BaseModel):
+        next: Literal["Linter", "Optimizer", "Sanitizer", "Helper"]
+
+    tracker = llm.UsageTracker()
+
+    async def turn():
+        try:
+            supervisor = llm.get_chat_model(max_tokens=5000, temperature=0.25)
+            worker = llm.get_chat_model(temperature=0.15, max_tokens=4000)
+
+            response = await supervisor.with_structured_output(routeResponse, include_raw=True).ainvoke(
+                [HumanMessage(content="Optimize this code")])
+            tracker.record("Supervisor", response["raw"])
+            assert response["parsed"].next == "Optimizer"
+
+            tracker.record("Optimizer", await worker.ainvoke([HumanMessage(content="Optimize this code")]))
+        finally:
+            await llm.close_http_clients()
+
+    asyncio.run(turn())
+
+    # Both calls went over the same keep-alive connection (same client address and port)
+    assert len(server.clients) == 2
+    assert len(set(server.clients)) == 1
+
+    for name in ("Supervisor", "Optimizer"):
+        assert tracker.usage[name] == {"calls": 1, "input": 1500, "cached": 1024, "output": 20}
+    assert "1024 cached, 68%" in tracker.report()
@@ -0,0 +1,175 @@
+"""
+SchedulingTransport against a local server that answers with 429 / 503 before letting requests through.
+"""
+
+# General imports
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httpx
+import pytest
+
+from scheduler import SchedulingTransport, TokenBucket, retry_after
+
+
+class FlakyServer(BaseHTTPRequestHandler):
+    """
+    The first request with body b"a" gets a 429 with Retry-After: 1, the first with body b"b" a 503, the first
+    with body b"e" a 429 with a malformed Retry-After, every other request a 200 after `delay` seconds.
+    """
+    protocol_version = "HTTP/1.1"
+    lock = threading.Lock()
+    hits = []
+    delay = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        with self.lock:
+            first = body not in [hit for hit, _ in self.hits]
+            self.hits.append((body, time.monotonic()))
+
+        if first and body == b"a":
+            self.reply(429, b"rate limited", {"Retry-After": "1"})
+        elif first and body == b"b":
+            self.reply(503, b"unavailable")
+        elif first and body == b"e":
+            self.reply(429, b"rate limited", {"Retry-After": "soon"})
+        else:
+            time.sleep(self.delay)
+            self.reply(200, b"ok " + body)
+
+    def reply(self, status: int, content: bytes, headers: dict = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+@pytest.fixture
+def server():
+    FlakyServer.hits = []
+    FlakyServer.delay = 0.0
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FlakyServer)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield FlakyServer, f"http://127.0.0.1:{httpd.server_port}/v1/chat/completions"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def arrivals(handler, body: bytes) -> list:
+    return [at for hit, at in handler.hits if hit == body]
+
+
+def test_retries_and_pauses_all_requests_after_429(server):
+    handler, url = server
+    transport = SchedulingTransport(httpx.AsyncHTTPTransport(), base_delay=0.05)
+
+    async def run():
+        async with httpx.AsyncClient(transport=transport) as client:
+            first = asyncio.create_task(client.post(url, content=b"a"))
+
+            # Queue the second request once the 429 has paused the transport
+            while not arrivals(handler, b"a"):
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.2)
+            second = asyncio.create_task(client.post(url, content=b"b"))
+
+            return await first, await second
+
+    first, second = asyncio.run(run())
+
+    assert (first.status_code, first.content) == (200, b"ok a")
+    assert (second.status_code, second.content) == (200, b"ok b")
+    assert transport.stats == {"sent": 4, "retried": 2, "coalesced": 0}
+
+    # The 429 on "a" held back "b" as well, until its Retry-After had passed
+    rate_limited = arrivals(handler, b"a")[0]
+    assert arrivals(handler, b"b")[0] - rate_limited >= 1.0
+    assert arrivals(handler, b"a")[1] - rate_limited >= 1.0
+
+
+def test_identical_requests_in_flight_are_coalesced(server):
+    handler, url = server
+    handler.delay = 0.3
+    transport = SchedulingTransport(httpx.AsyncHTTPTransport())
+
+    async def run():
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await asyncio.gather(*[client.post(url, content=body) for body in (b"c", b"c", b"c", b"d")])
+
+    responses = asyncio.run(run())
+
+    assert [response.content for response in responses] == [b"ok c", b"ok c", b"ok c", b"ok d"]
+    assert transport.stats == {"sent": 2, "retried": 0, "coalesced": 2}
+    assert len(handler.hits) == 2
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"retry-after": "2"}, 2.0),
+    ({"retry-after-ms": "250"}, 0.25),
+    ({"retry-after": "Thu, 01 Jan 1970 00:00:00 GMT"}, 0.0),
+    ({"retry-after": "soon"}, None),
+    ({}, None),
+])
+def test_retry_after(headers, expected):
+    assert retry_after(headers) == expected
+
+
+def test_malformed_retry_after_falls_back_to_backoff(server):
+    handler, url = server
+    transport = SchedulingTransport(httpx.AsyncHTTPTransport(), base_delay=0.05)
+
+    async def run():
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await client.post(url, content=b"e")
+
+    response = asyncio.run(run())
+
+    assert (response.status_code, response.content) == (200, b"ok e")
+    assert transport.stats == {"sent": 2, "retried": 1, "coalesced": 0}
+
+
+def test_request_bucket_spaces_requests(server):
+    handler, url = server
+    transport = SchedulingTransport(httpx.AsyncHTTPTransport(), requests_per_minute=600)
+    # Start from an empty bucket, so every request waits for the refill of 10 requests per second
+    transport.request_bucket.tokens = 0
+
+    async def run():
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await asyncio.gather(*[client.post(url, content=f"r{i}".encode()) for i in range(5)])
+
+    assert all(response.status_code == 200 for response in asyncio.run(run()))
+
+    times = sorted(at for _, at in handler.hits)
+    gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+    assert len(times) == 5
+    assert all(gap >= 0.08 for gap in gaps)
+    assert times[-1] - times[0] < 1.0
+
+
+def test_token_bucket_lets_oversized_requests_through_when_full():
+
+    async def run():
+        bucket = TokenBucket(600)
+
+        # Bigger than the bucket: clamped to its capacity instead of waiting forever
+        start = time.monotonic()
+        await bucket.acquire(10_000)
+        oversized = time.monotonic() - start
+
+        # The bucket is now empty, the next token takes 1/10 s to refill
+        start = time.monotonic()
+        await bucket.acquire(1)
+        return oversized, time.monotonic() - start
+
+    oversized, refill = asyncio.run(run())
+
+    assert oversized < 0.05
+    assert 0.08 <= refill < 0.5
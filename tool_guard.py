@@ -0,0 +1,81 @@
+"""
+Per-turn guard for the tool nodes.
+
+Identical tool calls (same tool, same arguments) made during a turn are only executed once; later calls get
+the earlier result back. The turn also has a budget on the number of tool calls (executed or memoized, so an
+agent repeating the same call cannot loop forever) and on wall time.
+Once a budget is spent, further calls are refused with a message asking the agent to answer with what it has.
+"""
+
+# General imports
+import asyncio
+import json
+import time
+
+DEFAULT_MAX_CALLS = 10
+DEFAULT_MAX_SECONDS = 180
+
+
+class ToolGuard:
+
+    def __init__(self, max_calls: int = DEFAULT_MAX_CALLS, max_seconds: float = DEFAULT_MAX_SECONDS):
+        self.max_calls = max_calls
+        self.max_seconds = max_seconds
+        self.start = time.monotonic()
+        self.memo = {}
+        self.calls = 0
+        self.hits = 0
+        self.refused = 0
+        self.exhausted = None
+
+    @staticmethod
+    def key(call: dict) -> tuple:
+        return call["name"], json.dumps(call["args"], sort_keys=True, default=str)
+
+    def check_budget(self):
+        # Returns the reason the budget is spent, or None while there is budget left
+        if self.exhausted is None:
+            elapsed = time.monotonic() - self.start
+            if self.max_calls is not None and self.calls + self.hits >= self.max_calls:
+                self.exhausted = f"tool call budget of {self.max_calls} calls reached"
+            elif self.max_seconds is not None and elapsed >= self.max_seconds:
+                self.exhausted = f"wall time budget of {self.max_seconds}s reached"
+        return self.exhausted
+
+    async def run(self, call: dict, execute):
+        """
+        Runs a tool call through the memo and the budget.
+
+        Args:
+            call (dict): The tool call, as found in AIMessage.tool_calls.
+            execute (Callable): Coroutine function that actually executes the call.
+
+        Returns:
+            The tool output, the memoized output of an identical earlier call, or a refusal message.
+        """
+        key = self.key(call)
+
+        reason = self.check_budget()
+        if reason is not None:
+            self.refused += 1
+            return (f"Not executed: {reason} for this turn. Do not call any more tools; "
+                    f"answer the user with the results you already have.")
+
+        # The memo holds tasks, so identical calls issued in parallel share a single execution as well
+        if key in self.memo:
+            self.hits += 1
+            print(f"Reusing result of an identical {call['name']} call")
+            return await self.memo[key]
+
+        self.calls += 1
+        task = asyncio.ensure_future(execute())
+        self.memo[key] = task
+        return await task
+
+    def report(self) -> str:
+        elapsed = time.monotonic() - self.start
+        report = (f"Tools: {self.calls} executed, {self.hits} memoized, {self.refused} refused "
+                  f"in {elapsed:.1f}s")
+        if self.exhausted is not None:
+            report += f" ({self.exhausted})"
+        return report
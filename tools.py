@@ -4,26 +4,47 @@ This file contains the tools that will be used in the LLM.
 
 # General imports
 import requests
-import docker
-import uuid
-import tempfile
-import docker.utils
+import json
+import time
 
+from pathlib import Path
 from urllib.parse import urlparse
-from utils import trim_md, clean_logs, format_pylint_output, extract_webpage_content
+from utils import trim_md, format_pylint_output, extract_webpage_content, parse_callgrind_annotate, format_hotspots, \
+    format_benchmark
+from sandbox import Sandbox, run_in_sandbox, TIMEOUT_EXIT_CODE
 
 # Langchain
 from langchain_core.tools import tool
 
 
+# Builds the sandbox payload from the main source file plus any additional files
+def build_payload(main_name: str, code: str, files: dict = None) -> dict:
+    payload = {name: trim_md(content) for name, content in (files or {}).items()}
+    payload[main_name] = code
+    return payload
+
+
+# Lists the C/C++ translation units of a payload, main source first, so extra .c/.cpp files get compiled too
+def native_sources(payload: dict, main_name: str) -> list:
+    extra = sorted(name for name in payload
+                   if name != main_name and name.rsplit(".", 1)[-1] in ("c", "cc", "cpp", "cxx"))
+    return [main_name] + extra
+
+
+# Reads one of the helper scripts in harness/ that are shipped into the sandbox next to the user code
+def load_harness(name: str) -> str:
+    return (Path(__file__).parent / "harness" / name).read_text(encoding="utf-8")
+
+
 # Python error check
 @tool
-def run_python_docker(code: str) -> dict:
+def run_python_docker(code: str, files: dict = None) -> dict:
     """
     Runs Python code insider a docker container and returns the output or errors.
 
     Args:
         code (str) : Python code to execute.
+        files (dict, optional): Additional files the code needs, mapping relative file names (e.g. "helpers.py") to their content.
     
     Returns:
         dict: Contains "success" (bool), "output" (str) and "error" (str).
@@ -34,26 +55,11 @@ def run_python_docker(code: str) -> dict:
 
     print("\n\nPYTHON\n\n")
 
-    # Initializer docker client
-    client = docker.from_env()
-
     try:
-        # Create a temporary container with the python image
-        container = client.containers.run(image="tomassoares/jetbrains-cleaner-tool:latest",
-                                          command=f"python3 -c '{code}'",
-                                          detach=True,
-                                          stdin_open=True,
-                                          tty=True)
-
-        # Wait for the container to finish
-        exit_status = container.wait()["StatusCode"]
-        raw_logs = container.logs().decode("utf-8")
-        logs = clean_logs(raw_logs)
+        # The code is copied into the container as main.py, so quotes in it need no escaping
+        exit_status, logs = run_in_sandbox(build_payload("main.py", code, files), ["python3", "main.py"])
         print(logs)
 
-        # Clean up container
-        container.remove()
-
         if exit_status == 0:
             return {"success": True, "output": logs, "error": None}
         else:
@@ -78,134 +84,149 @@ def lint_python_docker(code: str) -> dict:
     """
 
     print("\n\nPYTHON LINT\n\n")
-    client = docker.from_env()
-    container_image = "tomassoares/jetbrains-cleaner-tool:latest"
+    code = trim_md(code)
+
+    try:
+        with Sandbox({"main.py": code}) as sandbox:
+            # Absolute path so the pylint messages keep the format expected by format_pylint_output
+            exit_status, raw_logs = sandbox.exec(["pylint", f"{sandbox.workdir}/main.py"])
+
+        # Parse pylint logs for human-readable output
+        human_readable_output = format_pylint_output(raw_logs)
+
+        # Set success based on exit code
+        if exit_status == 0:
+            return {"success": True, "output": human_readable_output, "error": None}
+        else:
+            return {"success": False, "output": None, "error": human_readable_output}
+
+    except Exception as e:
+        return {"success": False, "output": None, "error": str(e)}
+
+
+# Exit codes reserved for the checkers, so their findings can't be confused with the program returning 1 itself
+SANITIZER_EXIT_CODE = 98
+VALGRIND_EXIT_CODE = 99
+SANITIZER_ENV = {"ASAN_OPTIONS": f"exitcode={SANITIZER_EXIT_CODE}",
+                 "UBSAN_OPTIONS": f"halt_on_error=1:exitcode={SANITIZER_EXIT_CODE}"}
+SANITIZER_MARKERS = ("ERROR: AddressSanitizer", "ERROR: LeakSanitizer", "runtime error:")
+
+
+# Sanitizes the main source file in tiers, cheapest first:
+#   1. syntax check (-fsyntax-only) + cppcheck
+#   2. AddressSanitizer/UndefinedBehaviorSanitizer build and run
+#   3. Valgrind run
+# In tiered mode the run ends at the first tier that finds a problem, unless leak_detail asks for Valgrind anyway.
+# A program that simply exits with a non-zero code (e.g. a usage message for missing params) is not a problem.
+def sanitize_native(compiler: str, payload: dict, source_filename: str, params: list,
+                    tiered: bool = True, leak_detail: bool = False) -> dict:
+    params = [str(p) for p in params]
+    sources = native_sources(payload, source_filename)
+    sections = []
+    timings = {}
+    problems = []
+
+    def run_step(tier, title, command, timeout=None, environment=None):
+        start = time.perf_counter()
+        exit_code, logs = sandbox.exec(command, timeout=timeout, environment=environment)
+        timings[tier] = round(timings.get(tier, 0) + time.perf_counter() - start, 3)
+        sections.append(f"== {title} ==\n{logs}" if logs else f"== {title} ==\n(no output)")
+        return exit_code, logs
+
+    def program_exit(exit_code):
+        # Ordinary non-zero exits of the program are reported in the output, not as problems
+        if exit_code != 0:
+            sections.append(f"(program exited with code {exit_code}, no checker finding)")
+
+    def result():
+        output = "\n\n".join(sections)
+        print(output)
+        print(f"Sanitizer tier timings: {timings}")
+        if problems:
+            return {"success": False, "output": output, "error": "; ".join(problems), "timings": timings}
+        return {"success": True, "output": output, "error": None, "timings": timings}
 
     try:
-        with tempfile.NamedTemporaryFile(delete=False, mode="w", encoding="utf-8", suffix=".py") as temp_file:
-            temp_file.write(code)
-            temp_file.close()
-
-            container_code_path = f"/tmp/{uuid.uuid4().hex}.py"
-            command = f"pylint {container_code_path}"
-
-            container = client.containers.run(
-                image=container_image,
-                command=command,
-                volumes={temp_file.name: {
-                    "bind": container_code_path,
-                    "mode": "ro"
-                }},
-                detach=True,
-                tty=True,
-                stdin_open=True,
-            )
-
-            exit_status = container.wait()["StatusCode"]
-            raw_logs = container.logs().decode("utf-8")
-
-            container.remove()
-
-            # Parse pylint logs for human-readable output
-            human_readable_output = format_pylint_output(raw_logs)
-
-            # Set success based on exit code
-            if exit_status == 0:
-                return {"success": True, "output": human_readable_output, "error": None}
+        with Sandbox(payload) as sandbox:
+            # Tier 1: static checks, nothing else can run if the code does not compile
+            if run_step("syntax", "Syntax check", [compiler, "-fsyntax-only", "-Wall", "-Wextra"] + sources)[0] != 0:
+                problems.append("Compilation failed")
+                return result()
+
+            if run_step("syntax", "cppcheck",
+                        ["cppcheck", "--error-exitcode=1", "--enable=warning", "--quiet"] + sources)[0] != 0:
+                problems.append("cppcheck found problems")
+                if tiered and not leak_detail:
+                    return result()
+
+            # Tier 2: run with AddressSanitizer and UndefinedBehaviorSanitizer
+            # (skipped in tiered mode if tier 1 found a problem and we only continue for the Valgrind leak detail)
+            if not (tiered and problems):
+                if run_step("asan", "AddressSanitizer build",
+                            [compiler, "-g"] + sources + ["-o", "prog_asan", "-fsanitize=address,undefined",
+                             "-fno-sanitize-recover=undefined", "-static-libasan"])[0] != 0:
+                    problems.append("Error in AddressSanitizer compilation")
+                    return result()
+
+                exit_code, logs = run_step("asan", "AddressSanitizer run", ["./prog_asan"] + params, timeout=30,
+                                           environment=SANITIZER_ENV)
+                if exit_code == SANITIZER_EXIT_CODE or any(marker in logs for marker in SANITIZER_MARKERS):
+                    problems.append("AddressSanitizer/UndefinedBehaviorSanitizer reported an error")
+                    if tiered and not leak_detail:
+                        return result()
+                elif exit_code == TIMEOUT_EXIT_CODE:
+                    # Valgrind is much slower and would time out as well
+                    problems.append("AddressSanitizer run timed out after 30s")
+                    if tiered and not leak_detail:
+                        return result()
+                else:
+                    program_exit(exit_code)
+
+            # Tier 3: Valgrind, only reached when the earlier tiers are clean or leak origins were requested
+            if run_step("valgrind", "Valgrind build", [compiler, "-g"] + sources + ["-o", "prog_valgrind"])[0] != 0:
+                problems.append("Error in Valgrind compilation")
+                return result()
+
+            exit_code, _ = run_step("valgrind", "Valgrind run",
+                                    ["valgrind", "--leak-check=full", "--track-origins=yes",
+                                     f"--error-exitcode={VALGRIND_EXIT_CODE}", "./prog_valgrind"] + params, timeout=60)
+            if exit_code == VALGRIND_EXIT_CODE:
+                problems.append("Valgrind found memory errors or leaks")
+            elif exit_code == TIMEOUT_EXIT_CODE:
+                problems.append("Valgrind run timed out after 60s")
             else:
-                return {"success": False, "output": None, "error": human_readable_output}
+                program_exit(exit_code)
+
+            return result()
 
     except Exception as e:
+        print(str(e))
         return {"success": False, "output": None, "error": str(e)}
 
 
 # C sanitizer
 @tool
-def clean_c_docker(code: str, params: list) -> dict:
+def clean_c_docker(code: str, params: list, files: dict = None, tiered: bool = True,
+                   leak_detail: bool = False) -> dict:
     """
     Compiles C code in docker container and runs valgrind + fsanitize to report potential leaks.
 
     Args:
         code (str): The C source code to compile and sanitize using leak sanitizer and valgrind.
         params (list): A list of strings representing the parameters that are given to the C code to run.
+        files (dict, optional): Additional files the code needs, mapping relative file names (e.g. "util.h", "util.c") to their content. Extra .c sources are compiled and linked with the main file.
+        tiered (bool, optional): Run cheap checks first (syntax check + cppcheck, then AddressSanitizer) and stop at the first tier that finds a problem. Defaults to True.
+        leak_detail (bool, optional): Always run Valgrind for leak-origin detail, even if an earlier tier found a problem. Defaults to False.
 
     Returns:
-        dict: Contains the success flag, sanitize (valgrind+fsanitize) output, and any errors.
+        dict: Contains the success flag, sanitize (valgrind+fsanitize) output, any errors and the time spent per tier.
     """
 
     print("\n\nC\n\n")
     # Remove markdown delimiters from the code
     code = trim_md(code)
 
-    try:
-        client = docker.from_env()
-        # Generate unique filenames for the source code and executables
-        source_filename = f"/tmp/{uuid.uuid4().hex}.c"
-        executable_filename_asan = f"/tmp/{uuid.uuid4().hex}_asan"
-        executable_filename_valgrind = f"/tmp/{uuid.uuid4().hex}_valgrind"
-
-        # Create a temporary file to hold the C code
-        with tempfile.NamedTemporaryFile(delete=False, mode='w', encoding='utf-8') as temp_file:
-            temp_file.write(code)
-            temp_file.close()
-
-        # Create and start the container with a shell (this allows executing multiple commands)
-        container = client.containers.run(
-            image="tomassoares/jetbrains-cleaner-tool",
-            command="sleep infinity",  # Start the container with a long-running process
-            volumes={temp_file.name: {
-                'bind': source_filename,
-                'mode': 'ro'
-            }},
-            detach=True,
-            tty=True,
-            stdin_open=True)
-
-        try:
-            # Step 1: Compile with AddressSanitizer
-            result = container.exec_run(
-                f"gcc {source_filename} -o {executable_filename_asan} -fsanitize=address,undefined -static-libasan",
-                stderr=True,
-                stdout=True)
-            if result.exit_code != 0:
-                logs = result.output.decode('utf-8')
-                return {"success": False, "output": logs, "error": "Error in AddressSanitizer compilation"}
-
-            # Step 2: Compile for Valgrind
-            result = container.exec_run(f"gcc {source_filename} -o {executable_filename_valgrind}",
-                                        stderr=True,
-                                        stdout=True)
-            if result.exit_code != 0:
-                logs = result.output.decode('utf-8')
-                return {"success": False, "output": logs, "error": "Error in Valgrind compilation"}
-
-            # Step 3: Run Valgrind on the compiled code
-            result = container.exec_run(
-                f"valgrind --leak-check=full --track-origins=yes {executable_filename_valgrind} {' '.join(params)}",
-                stderr=True,
-                stdout=True)
-            if result.exit_code != 0:
-                logs = result.output.decode('utf-8')
-                return {"success": False, "output": logs, "error": "Valgrind execution failed"}
-
-            # If all commands succeed, return the logs
-            logs = result.output.decode('utf-8')
-            print(logs)
-            return {"success": True, "output": logs, "error": None}
-
-        except Exception as e:
-            print(str(e))
-            return {"success": False, "output": None, "error": str(e)}
-
-        finally:
-            # Clean up: stop and remove the container
-            container.stop()
-            container.remove()
-
-    except Exception as e:
-        print("fudeu")
-        print(str(e))
-        return {"success": False, "output": None, "error": str(e)}
+    return sanitize_native("gcc", build_payload("main.c", code, files), "main.c", params, tiered, leak_detail)
 
 
 # C linter
@@ -226,41 +247,14 @@ def lint_c_docker(code: str) -> dict:
     code = trim_md(code)
 
     try:
-        client = docker.from_env()
-
-        source_filename = f"/tmp/{uuid.uuid4().hex}.c"
-
-        with tempfile.NamedTemporaryFile(delete=False, mode='w', encoding='utf-8') as temp_file:
-            temp_file.write(code)
-            temp_file.close()
-
-            # Command to lint the code using clang-tidy
-            command = (f"sh -c 'clang-tidy {source_filename} -- && "
-                       f"clang-format -i {source_filename} && "
-                       f"cppcheck {source_filename}'")
-
-            container = client.containers.run(image="tomassoares/jetbrains-cleaner-tool:latest",
-                                              command=command,
-                                              volumes={temp_file.name: {
-                                                  'bind': f'{source_filename}',
-                                                  'mode': 'ro'
-                                              }},
-                                              detach=True,
-                                              tty=True,
-                                              stdin_open=True)
-
-            # Wair for linting to complete
-            exit_status = container.wait()["StatusCode"]
-            raw_logs = container.logs().decode('utf-8')
-            logs = clean_logs(raw_logs)
-
-            # Cleanup container
-            container.remove()
-
-            if exit_status == 0:
-                return {"success": True, "output": logs, "error": None}
-            else:
-                return {"success": True, "output": None, "error": logs}
+        # Command to lint the code using clang-tidy, the file name is fixed so nothing user supplied reaches the shell
+        command = ["sh", "-c", "clang-tidy main.c -- && clang-format -i main.c && cppcheck main.c"]
+        exit_status, logs = run_in_sandbox({"main.c": code}, command)
+
+        if exit_status == 0:
+            return {"success": True, "output": logs, "error": None}
+        else:
+            return {"success": True, "output": None, "error": logs}
 
     except Exception as e:
         return {"success": False, "output": None, "error": str(e)}
@@ -268,87 +262,27 @@ def lint_c_docker(code: str) -> dict:
 
 # C++ sanitizer
 @tool
-def clean_cpp_docker(code: str, params: list) -> dict:
+def clean_cpp_docker(code: str, params: list, files: dict = None, tiered: bool = True,
+                     leak_detail: bool = False) -> dict:
     """
     Compiles C++ code in docker container and runs valgrind + fsanitize to report potential leaks.
 
     Args:
         code (str): The C++ source code to compile and sanitize using leak sanitizer and valgrind.
         params (list): A list of strings representing the parameters that are given to the C code to run.
+        files (dict, optional): Additional files the code needs, mapping relative file names (e.g. "util.hpp", "util.cpp") to their content. Extra .cpp sources are compiled and linked with the main file.
+        tiered (bool, optional): Run cheap checks first (syntax check + cppcheck, then AddressSanitizer) and stop at the first tier that finds a problem. Defaults to True.
+        leak_detail (bool, optional): Always run Valgrind for leak-origin detail, even if an earlier tier found a problem. Defaults to False.
 
     Returns:
-        dict: Contains the success flag, sanitize (valgrind+fsanitize) output, and any errors.
+        dict: Contains the success flag, sanitize (valgrind+fsanitize) output, any errors and the time spent per tier.
     """
 
     print("\n\nC++\n\n")
     # Remove markdown delimiters from the code
     code = trim_md(code)
 
-    try:
-        client = docker.from_env()
-        # Generate unique filenames for the source code and executables
-        source_filename = f"/tmp/{uuid.uuid4().hex}.cpp"
-        executable_filename_asan = f"/tmp/{uuid.uuid4().hex}_asan"
-        executable_filename_valgrind = f"/tmp/{uuid.uuid4().hex}_valgrind"
-
-        # Create a temporary file to hold the C++ code
-        with tempfile.NamedTemporaryFile(delete=False, mode='w', encoding='utf-8') as temp_file:
-            temp_file.write(code)
-            temp_file.close()
-
-        # Create and start the container with a shell (this allows executing multiple commands)
-        container = client.containers.run(
-            image="tomassoares/jetbrains-cleaner-tool",
-            command="sleep infinity",  # Start the container with a long-running process
-            volumes={temp_file.name: {
-                'bind': source_filename,
-                'mode': 'ro'
-            }},
-            detach=True,
-            tty=True,
-            stdin_open=True)
-
-        try:
-            # Step 1: Compile with AddressSanitizer
-            result = container.exec_run(
-                f"g++ {source_filename} -o {executable_filename_asan} -fsanitize=address,undefined -static-libasan",
-                stderr=True,
-                stdout=True)
-            if result.exit_code != 0:
-                logs = result.output.decode('utf-8')
-                return {"success": False, "output": logs, "error": "Error in AddressSanitizer compilation"}
-
-            # Step 2: Compile for Valgrind
-            result = container.exec_run(f"gcc {source_filename} -o {executable_filename_valgrind}",
-                                        stderr=True,
-                                        stdout=True)
-            if result.exit_code != 0:
-                logs = result.output.decode('utf-8')
-                return {"success": False, "output": logs, "error": "Error in Valgrind compilation"}
-
-            # Step 3: Run Valgrind on the compiled code
-            result = container.exec_run(
-                f"valgrind --leak-check=full --track-origins=yes {executable_filename_valgrind} {' '.join(params)}",
-                stderr=True,
-                stdout=True)
-            if result.exit_code != 0:
-                logs = result.output.decode('utf-8')
-                return {"success": False, "output": logs, "error": "Valgrind execution failed"}
-
-            # If all commands succeed, return the logs
-            logs = result.output.decode('utf-8')
-            return {"success": True, "output": logs, "error": None}
-
-        except Exception as e:
-            return {"success": False, "output": None, "error": str(e)}
-
-        finally:
-            # Clean up: stop and remove the container
-            container.stop()
-            container.remove()
-
-    except Exception as e:
-        return {"success": False, "output": None, "error": str(e)}
+    return sanitize_native("g++", build_payload("main.cpp", code, files), "main.cpp", params, tiered, leak_detail)
 
 
 # C++ linter
@@ -369,46 +303,172 @@ def lint_cpp_docker(code: str) -> dict:
     code = trim_md(code)
 
     try:
-        client = docker.from_env()
-
-        source_filename = f"/tmp/{uuid.uuid4().hex}.c"
-
-        with tempfile.NamedTemporaryFile(delete=False, mode='w', encoding='utf-8') as temp_file:
-            temp_file.write(code)
-            temp_file.close()
-
-            # Command to lint the code using clang-tidy
-            command = (f"sh -c 'clang-tidy {source_filename} -- && "
-                       f"clang-format -i {source_filename} && "
-                       f"cppcheck {source_filename}'")
-            try:
-                container = client.containers.run(
-                    image="tomassoares/jetbrains-cleaner-tool:latest",
-                    command=command,
-                    volumes={temp_file.name: {
-                        'bind': f'{source_filename}',
-                        'mode': 'ro'
-                    }},
-                    detach=True,
-                    tty=True,
-                    stdin_open=True)
-
-                # Wair for linting to complete
-                exit_status = container.wait(20)["StatusCode"]
-                raw_logs = container.logs().decode('utf-8')
-                logs = clean_logs(raw_logs)
-
-            except Exception as docker_e:
-                container.remove(force=True)
-                return {"success": False, "output": None, "error": str(docker_e)}
-
-            # Cleanup container
-            container.remove()
-
-            if exit_status == 0:
-                return {"success": True, "output": logs, "error": None}
-            else:
-                return {"success": True, "output": None, "error": logs}
+        # Command to lint the code using clang-tidy
+        command = ["sh", "-c", "clang-tidy main.cpp -- && clang-format -i main.cpp && cppcheck main.cpp"]
+        exit_status, logs = run_in_sandbox({"main.cpp": code}, command, timeout=20)
+
+        if exit_status == 0:
+            return {"success": True, "output": logs, "error": None}
+        else:
+            return {"success": True, "output": None, "error": logs}
+
+    except Exception as e:
+        return {"success": False, "output": None, "error": str(e)}
+
+
+# Profiler
+@tool
+def profile_code(code: str, language: str, params: list = None, files: dict = None, top_n: int = 15) -> dict:
+    """
+    Runs code under a profiler inside a docker container and returns a table of the hotspots.
+    Python runs under cProfile (times in seconds), C/C++ is built with -O2 -g and runs under callgrind (costs in instructions).
+
+    Args:
+        code (str): The source code to profile. It must run on its own, e.g. have a main function or module level driver code.
+        language (str): One of "python", "c" or "c++".
+        params (list, optional): A list of strings given to the program as command line arguments.
+        files (dict, optional): Additional files the code needs, mapping relative file names to their content.
+        top_n (int, optional): Number of functions in the hotspot table. Defaults to 15.
+
+    Returns:
+        dict: Contains the success flag, the hotspot table with inclusive and exclusive cost per function followed by the program output, and any errors.
+    """
+
+    print("\n\nPROFILER\n\n")
+    code = trim_md(code)
+    params = [str(p) for p in (params or [])]
+    language = language.lower().strip()
+
+    try:
+        if language == "python":
+            payload = build_payload("main.py", code, files)
+            payload["profile_python.py"] = load_harness("profile_python.py")
+
+            exit_code, logs = run_in_sandbox(payload, ["python3", "profile_python.py", "main.py"] + params, timeout=120)
+
+            program_output, _, report = logs.rpartition("@@PROFILE@@")
+            if not report:
+                return {"success": False, "output": logs, "error": "Profiling failed"}
+            report = json.loads(report)
+            table = format_hotspots(report["rows"], "s", top_n)
+            program_exit_code = report["exit_code"]
+
+        elif language in ("c", "c++", "cpp"):
+            compiler, source_filename = ("gcc", "main.c") if language == "c" else ("g++", "main.cpp")
+
+            payload = build_payload(source_filename, code, files)
+
+            with Sandbox(payload) as sandbox:
+                exit_code, logs = sandbox.exec([compiler, "-O2", "-g"] + native_sources(payload, source_filename)
+                                               + ["-o", "prog"])
+                if exit_code != 0:
+                    return {"success": False, "output": logs, "error": "Compilation failed"}
+
+                program_exit_code, program_output = sandbox.exec(
+                    ["valgrind", "--tool=callgrind", "--callgrind-out-file=callgrind.out", "./prog"] + params,
+                    timeout=300)
+
+                _, exclusive = sandbox.exec(["callgrind_annotate", "--inclusive=no", "callgrind.out"])
+                _, inclusive = sandbox.exec(["callgrind_annotate", "--inclusive=yes", "callgrind.out"])
+
+            exclusive, inclusive = parse_callgrind_annotate(exclusive), parse_callgrind_annotate(inclusive)
+            if not exclusive:
+                return {"success": False, "output": program_output, "error": "Profiling failed"}
+
+            rows = [{"function": name, "calls": None, "exclusive": cost, "inclusive": inclusive.get(name, cost)}
+                    for name, cost in exclusive.items()]
+            table = format_hotspots(rows, "Ir", top_n)
+
+        else:
+            return {"success": False, "output": None, "error": f"Unsupported language: {language}"}
+
+        output = f"{table}\n\nProgram exit code: {program_exit_code}\nProgram output:\n{program_output.strip()[-2000:]}"
+        print(output)
+        return {"success": True, "output": output, "error": None}
+
+    except Exception as e:
+        return {"success": False, "output": None, "error": str(e)}
+
+
+# Before/after benchmark
+@tool
+def benchmark_code(original: str,
+                   candidate: str,
+                   language: str,
+                   driver: str = "",
+                   stdin: str = "",
+                   params: list = None,
+                   warmup: int = 2,
+                   repeat: int = 7) -> dict:
+    """
+    Benchmarks an original and a candidate (optimized) implementation inside a docker container and checks that both produce the same output.
+    Python is timed timeit-style (loop count picked automatically), C/C++ is compiled with -O2 and the programs are run repeatedly.
+
+    Args:
+        original (str): The original source code.
+        candidate (str): The candidate source code, with the same interface as the original.
+        language (str): One of "python", "c" or "c++".
+        driver (str, optional): Code exercising the implementation. For Python it is run against the definitions of each implementation; for C/C++ it is a separate source file (usually with main) compiled together with each implementation. Leave empty if the implementations run on their own.
+        stdin (str, optional): Input given on stdin to every run.
+        params (list, optional): A list of strings given to the C/C++ programs as command line arguments.
+        warmup (int, optional): Untimed runs before measuring. Defaults to 2.
+        repeat (int, optional): Number of timed repetitions. Defaults to 7.
+
+    Returns:
+        dict: Contains the success flag (both ran and the outputs match), the mean, spread and speedup ratio, and any errors.
+    """
+
+    print("\n\nBENCHMARK\n\n")
+    original, candidate, driver = trim_md(original), trim_md(candidate), trim_md(driver)
+    params = [str(p) for p in (params or [])]
+    language = language.lower().strip()
+    config = {"stdin": stdin, "warmup": warmup, "repeat": repeat}
+
+    try:
+        if language == "python":
+            config.update(mode="python", sources={"original": original, "candidate": candidate}, driver=driver)
+            payload = {"config.json": json.dumps(config), "benchmark.py": load_harness("benchmark.py")}
+
+            with Sandbox(payload) as sandbox:
+                _, logs = sandbox.exec(["python3", "benchmark.py", "config.json"], timeout=300)
+
+        elif language in ("c", "c++", "cpp"):
+            compiler, extension = ("gcc", "c") if language == "c" else ("g++", "cpp")
+            config.update(mode="native", commands={"original": ["./original"] + params,
+                                                   "candidate": ["./candidate"] + params})
+            payload = {f"original.{extension}": original, f"candidate.{extension}": candidate,
+                       "config.json": json.dumps(config), "benchmark.py": load_harness("benchmark.py")}
+            if driver:
+                payload[f"driver.{extension}"] = driver
+
+            with Sandbox(payload) as sandbox:
+                for name in ("original", "candidate"):
+                    sources = [f"{name}.{extension}"] + ([f"driver.{extension}"] if driver else [])
+                    exit_code, logs = sandbox.exec([compiler, "-O2"] + sources + ["-o", name])
+                    if exit_code != 0:
+                        return {"success": False, "output": logs, "error": f"Compilation of the {name} failed"}
+
+                _, logs = sandbox.exec(["python3", "benchmark.py", "config.json"], timeout=600)
+
+        else:
+            return {"success": False, "output": None, "error": f"Unsupported language: {language}"}
+
+        _, _, report = logs.rpartition("@@BENCHMARK@@")
+        if not report:
+            return {"success": False, "output": logs, "error": "Benchmark failed"}
+        report = json.loads(report)
+
+        output = format_benchmark(report)
+        print(output)
+
+        if "speedup" not in report:
+            return {"success": False, "output": output, "error": "One of the implementations failed to run"}
+        if not report["outputs_match"]:
+            return {"success": False,
+                    "output": output,
+                    "error": (f"Outputs differ.\nOriginal output:\n{report['outputs']['original']}\n"
+                              f"Candidate output:\n{report['outputs']['candidate']}")}
+        return {"success": True, "output": output, "error": None}
 
     except Exception as e:
         return {"success": False, "output": None, "error": str(e)}
@@ -1,3 +1,4 @@
+import ast
 import re
 import requests
 from bs4 import BeautifulSoup
@@ -16,6 +17,46 @@ def trim_md(code: str) -> str:
     return code.strip()
 
 
+# Extracts the file context attached by the plugin ("Context:"..." User Input: ...") from a chat message
+def extract_context(message: str):
+    # parse_chat_history stores the line as a Python repr, undo that first
+    if message[:1] in ("'", '"'):
+        try:
+            message = ast.literal_eval(message)
+        except (ValueError, SyntaxError):
+            pass
+
+    match = re.search(r'Context:"((?:[^"\\]|\\.)*)" User Input:', message, re.DOTALL)
+    if not match:
+        return None
+
+    # Undo the escaping done by the plugin
+    escapes = {"n": "\n", "t": "\t", "r": "\r"}
+    return re.sub(r"\\(.)", lambda m: escapes.get(m.group(1), m.group(1)), match.group(1))
+
+
+# Guesses the language of a piece of code: "c", "c++", "python" or None
+def detect_language(code: str):
+    code = trim_md(code)
+
+    cpp_markers = [r"#include\s*<(iostream|vector|string|map|memory|algorithm)>", r"\bstd::", r"\bnamespace\b",
+                   r"\btemplate\s*<", r"\bcout\b", r"\bnew\s+\w+", r"\bclass\s+\w+\s*[:{]"]
+    c_markers = [r"#include\s*[<\"]", r"\bint\s+main\s*\(", r"\bprintf\s*\(", r"\bmalloc\s*\(", r";\s*$"]
+    python_markers = [r"^\s*def\s+\w+\s*\(.*\)\s*:", r"^\s*(from\s+[\w.]+\s+)?import\s+\w+", r"^\s*class\s+\w+.*:\s*$",
+                      r"\bprint\s*\(", r"^\s*if\s+__name__\s*=="]
+
+    def score(markers):
+        return sum(1 for marker in markers if re.search(marker, code, re.MULTILINE))
+
+    if score(cpp_markers) > 0 and score(c_markers) > 0:
+        return "c++"
+    if score(c_markers) >= 2 and score(c_markers) >= score(python_markers):
+        return "c"
+    if score(python_markers) > 0:
+        return "python"
+    return None
+
+
 # Cleans up docker logs
 def clean_logs(logs: str) -> str:
     # Remove ANSI escape sequences
@@ -138,4 +179,61 @@ def extract_webpage_content(url: str) -> str:
     if content_areas:
         paragraphs = [area.get_text(" ", strip=True) for area in content_areas]
         return "\n\n".join(paragraphs)
-    return None
\ No newline at end of file
+    return None
+
+
+# Parses the function table printed by callgrind_annotate into {function: instruction count}
+def parse_callgrind_annotate(output: str) -> dict:
+    counts = {}
+    line_regex = re.compile(r"^\s*([\d,]+)\s+(?:\(\s*[\d.]+%\)\s+)?(?:[<>*]\s+)?(\S.*?)(?:\s+\[[^\]]*\])?\s*$")
+
+    for line in output.splitlines():
+        match = line_regex.match(line)
+        if not match or "PROGRAM TOTALS" in line:
+            continue
+        # Keep the function name, the source file path is mostly noise for the LLM. Split at the first colon
+        # (the file is "???" or a path), qualified C++ names like ns::Foo::bar() contain colons themselves
+        location = match.group(2)
+        name = location.split(":", 1)[1] if ":" in location else location
+        counts[name] = counts.get(name, 0) + int(match.group(1).replace(",", ""))
+
+    return counts
+
+
+# Formats profiler rows ({"function", "calls", "exclusive", "inclusive"}) as a compact hotspot table
+def format_hotspots(rows: list, unit: str, top_n: int = 15) -> str:
+    rows = sorted(rows, key=lambda row: row["exclusive"], reverse=True)
+    total = sum(row["exclusive"] for row in rows) or 1
+
+    def fmt(value):
+        return f"{value:.4f}" if isinstance(value, float) else f"{value:,}"
+
+    lines = [f"| Function | Calls | Exclusive ({unit}) | Excl % | Inclusive ({unit}) | Incl % |",
+             "|---|---|---|---|---|---|"]
+    for row in rows[:top_n]:
+        calls = row.get("calls")
+        lines.append(f"| {row['function']} | {calls if calls is not None else '-'} | {fmt(row['exclusive'])} | "
+                     f"{row['exclusive'] / total:.1%} | {fmt(row['inclusive'])} | {row['inclusive'] / total:.1%} |")
+
+    return "\n".join(lines)
+
+
+# Formats the report of harness/benchmark.py as a short summary
+def format_benchmark(report: dict, unit: str = "ms") -> str:
+    scale = 1000 if unit == "ms" else 1
+    lines = []
+
+    for name in ("original", "candidate"):
+        stats = report.get(name, {})
+        if "error" in stats:
+            lines.append(f"{name}: failed ({stats['error']})")
+            continue
+        lines.append(f"{name}: mean {stats['mean'] * scale:.4f} {unit} ± {stats['stdev'] * scale:.4f} {unit} "
+                     f"(min {stats['min'] * scale:.4f}, max {stats['max'] * scale:.4f}, "
+                     f"{stats['repeat']} repeats x {stats['number']} loops)")
+
+    if "speedup" in report:
+        lines.append(f"speedup: {report['speedup']:.2f}x")
+        lines.append(f"outputs match: {'yes' if report['outputs_match'] else 'NO'}")
+
+    return "\n".join(lines)